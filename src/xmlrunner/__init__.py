@@ -7,8 +7,11 @@ default TextTestRunner.
 
 import os
 import re
+import signal
 import sys
+import threading
 import time
+from functools import partial
 try:
     from unittest2.runner import TextTestRunner
     from unittest2.runner import TextTestResult as _TextTestResult
@@ -24,6 +27,8 @@ except ImportError:
 
 # Allow version to be detected at runtime.
 from .version import __version__, __version_info__
+from .cache import ResultCache, testcase_key
+from .watchdog import TestTimeout, Watchdog, in_test_code
 from collections import OrderedDict
 
 try:
@@ -99,6 +104,8 @@ class _TestInfo(object):
         self.err = err
         self.std_output = std_output
         self.err_output = err_output
+        self.cached = False
+        self.subtests = None
 
         self.test_description = self.test_result.getDescription(test_method)
         self.test_exception_info = (
@@ -106,6 +113,8 @@ class _TestInfo(object):
             else self.test_result._exc_info_to_string(
                     self.err, test_method)
         )
+        if outcome == self.ERROR and isinstance(self.err[1], TestTimeout):
+            self.test_exception_info += '\n' + self.err[1].stacks
 
         self.test_name = testcase_name(test_method)
         self.test_id = test_method.id()
@@ -146,6 +155,73 @@ class _TestInfo(object):
         return self.err_output
 
 
+class _SubTestInfo(object):
+    """
+    This class keeps a compact summary of the subtests executed by a test
+    method: how many of them ran, failed, raised an error or were skipped,
+    and the details of the first failures only, so that data-driven tests
+    with many subtests do not blow up reporting time and report size.
+    """
+
+    def __init__(self, failure_limit=None):
+        self.failure_limit = failure_limit
+        self.run = 0
+        # Failures and errors
+        self.failed = 0
+        self.errored = 0
+        self.skipped = 0
+        # (description, outcome, exception type, message, traceback)
+        self.failures = []
+
+    def add(self, test_result, test, subtest, err):
+        """
+        Records the outcome of a subtest.
+        """
+        self.run += 1
+        if err is None:
+            return
+        self.failed += 1
+        if issubclass(err[0], test.failureException):
+            outcome = _TestInfo.FAILURE
+        else:
+            outcome = _TestInfo.ERROR
+            self.errored += 1
+        if self.failure_limit is not None and \
+                len(self.failures) >= self.failure_limit:
+            return
+
+        description = subtest.id()[len(test.id()):].strip()
+        self.failures.append((
+            description, outcome, err[0].__name__, str(err[1]),
+            test_result._exc_info_to_string(err, test)
+        ))
+
+    def add_skip(self):
+        """
+        Records a skipped subtest.
+        """
+        self.run += 1
+        self.skipped += 1
+
+    def get_truncated(self):
+        """
+        Return the number of failures whose details were not kept.
+        """
+        return self.failed - len(self.failures)
+
+    def get_error_info(self):
+        """
+        Return a text representation of the subtest failures.
+        """
+        info = ['%s\n%s' % (failure[0], failure[4])
+                for failure in self.failures]
+        truncated = self.get_truncated()
+        if truncated:
+            info.append('... and %d more subtest failure%s\n' % (
+                truncated, truncated != 1 and "s" or ""))
+        return '\n'.join(info)
+
+
 class _XMLTestResult(_TextTestResult):
     """
     A test result class that can express test results in a XML report.
@@ -153,7 +229,8 @@ class _XMLTestResult(_TextTestResult):
     Used by XMLTestRunner.
     """
     def __init__(self, stream=sys.stderr, descriptions=1, verbosity=1,
-                 elapsed_times=True, per_test_output=False, encoding='utf-8'):
+                 elapsed_times=True, per_test_output=False, encoding='utf-8',
+                 track_modules=False, subtest_failure_limit=100):
         _TextTestResult.__init__(self, stream, descriptions, verbosity)
         self.successes = []
         self.callback = None
@@ -161,6 +238,14 @@ class _XMLTestResult(_TextTestResult):
         self.per_test_output = per_test_output
         self.encoding = encoding
         self.test_index = 0
+        self.track_modules = track_modules
+        self.testcase_modules = {}
+        self._testcase = None
+        self._testcase_modules = self._modules = set(sys.modules)
+        self.subtest_failure_limit = subtest_failure_limit
+        self._subtests = None
+        self._testinfo = None
+        self.watchdog = None
 
     def _prepare_callback(self, test_info, target_list, verbose_str,
                           short_str):
@@ -169,6 +254,7 @@ class _XMLTestResult(_TextTestResult):
         method to be called by stopTest method.
         """
         target_list.append(test_info)
+        self._testinfo = test_info
 
         def callback():
             """Prints the test method outcome to the stream, as well as
@@ -189,10 +275,39 @@ class _XMLTestResult(_TextTestResult):
                 self.stream.write(short_str)
         self.callback = callback
 
+    def track_testcase_modules(self, test=None):
+        """
+        Records the modules imported while the TestCase class of the previous
+        test was running, if the given test belongs to another class.
+
+        The snapshot of sys.modules a class is compared with is the one
+        taken after the last test of the class before, so that imports done
+        by setUpClass are accounted for as well.
+        """
+        if test is None:
+            # The test run is over, account for tearDownClass as well
+            testcase = None
+            self._modules = set(sys.modules)
+        else:
+            testcase = testcase_key(test)
+        if testcase == self._testcase:
+            return
+        if self._testcase is not None:
+            self.testcase_modules.setdefault(self._testcase, set()).update(
+                self._modules - self._testcase_modules
+            )
+        self._testcase = testcase
+        self._testcase_modules = self._modules
+
     def startTest(self, test):
         """
         Called before execute each test method.
         """
+        if self.track_modules:
+            self.track_testcase_modules(test)
+        self._subtests = self._testinfo = None
+        if self.watchdog is not None:
+            self.watchdog.arm(test)
         self.start_time = time.time()
         TestResult.startTest(self, test)
 
@@ -204,8 +319,20 @@ class _XMLTestResult(_TextTestResult):
         """
         Called after execute each test method.
         """
+        if self.watchdog is not None:
+            self.watchdog.disarm()
         _TextTestResult.stopTest(self, test)
         self.stop_time = time.time()
+        if self.track_modules and len(sys.modules) != len(self._modules):
+            self._modules = set(sys.modules)
+
+        if self._subtests is not None:
+            if self._subtests.failed and (
+                    self._testinfo is None or
+                    self._testinfo.outcome in (_TestInfo.SUCCESS, _TestInfo.SKIP)):
+                self._add_subtest_failures(test)
+            elif self._testinfo is not None:
+                self._testinfo.subtests = self._subtests
 
         if self.callback and callable(self.callback):
             self.callback()
@@ -266,6 +393,13 @@ class _XMLTestResult(_TextTestResult):
         """
         Called when a test method was skipped.
         """
+        if getattr(test, 'test_case', None) is not None:
+            # This is a subtest
+            if self._subtests is None:
+                self._subtests = _SubTestInfo(self.subtest_failure_limit)
+            self._subtests.add_skip()
+            return
+
         if self.per_test_output:
             testinfo = _TestInfo(self, test, _TestInfo.SKIP, reason,
                                  std_output=sys.stdout.getvalue(), err_output=sys.stderr.getvalue())
@@ -276,6 +410,65 @@ class _XMLTestResult(_TextTestResult):
         self.skipped.append((testinfo, reason))
         self._prepare_callback(testinfo, [], 'SKIP', 'S')
 
+    def addSubTest(self, test, subtest, err):
+        """
+        Called at the end of a subtest.
+        """
+        if self._subtests is None:
+            self._subtests = _SubTestInfo(self.subtest_failure_limit)
+        self._subtests.add(self, test, subtest, err)
+        if err is not None:
+            if getattr(self, 'failfast', False):
+                self.stop()
+            self._mirrorOutput = True
+
+    def _add_subtest_failures(self, test):
+        """
+        Reports a test method whose subtests failed, in place of any success
+        or skip reported for the test itself.
+        """
+        if self._testinfo is not None:
+            if self.successes and self.successes[-1] is self._testinfo:
+                self.successes.pop()
+            if self.skipped and self.skipped[-1][0] is self._testinfo:
+                self.skipped.pop()
+
+        if self._subtests.errored:
+            outcome, target_list = _TestInfo.ERROR, self.errors
+            verbose_str, short_str = 'ERROR', 'E'
+        else:
+            outcome, target_list = _TestInfo.FAILURE, self.failures
+            verbose_str, short_str = 'FAIL', 'F'
+
+        if self.per_test_output:
+            testinfo = _TestInfo(self, test,
+                                 std_output=sys.stdout.getvalue(), err_output=sys.stderr.getvalue())
+            sys.stdout.reset()
+            sys.stderr.reset()
+        else:
+            testinfo = _TestInfo(self, test)
+        testinfo.outcome = outcome
+        testinfo.test_exception_info = self._subtests.get_error_info()
+        testinfo.subtests = self._subtests
+        target_list.append((testinfo, testinfo.test_exception_info))
+        self._prepare_callback(testinfo, [], verbose_str, short_str)
+
+    def addCached(self, test, outcome, reason, elapsed_time):
+        """
+        Called for a test whose result was reused from a previous run
+        instead of being executed.
+        """
+        testinfo = _TestInfo(self, test, outcome, reason)
+        testinfo.cached = True
+        testinfo.elapsed_time = elapsed_time
+        testinfo.test_index = self.test_index
+        self.test_index += 1
+        self.testsRun += 1
+        if outcome == _TestInfo.SKIP:
+            self.skipped.append((testinfo, reason))
+        else:
+            self.successes.append(testinfo)
+
     def printErrorList(self, flavour, errors):
         """
         Writes information about the FAIL or ERROR to the stream.
@@ -358,8 +551,44 @@ class _XMLTestResult(_TextTestResult):
             'name', _XMLTestResult._test_method_name(test_result.test_id)
         )
         testcase.setAttribute('time', '%.3f' % test_result.elapsed_time)
+        if test_result.cached:
+            testcase.setAttribute('cached', 'true')
 
-        if (test_result.outcome != _TestInfo.SUCCESS):
+        if test_result.subtests is not None:
+            testcase.setAttribute('subtests', str(test_result.subtests.run))
+            testcase.setAttribute(
+                'subtest-failures', str(test_result.subtests.failed)
+            )
+            if test_result.subtests.skipped:
+                testcase.setAttribute(
+                    'subtest-skips', str(test_result.subtests.skipped)
+                )
+            if test_result.subtests.get_truncated():
+                testcase.setAttribute(
+                    'subtest-failures-truncated',
+                    str(test_result.subtests.get_truncated())
+                )
+            for description, outcome, err_type, message, error_info in \
+                    test_result.subtests.failures:
+                elem_name = ('failure', 'error')[outcome - 1]
+                failure = xml_document.createElement(elem_name)
+                testcase.appendChild(failure)
+                failure.setAttribute('type', err_type)
+                failure.setAttribute('message', xml_safe_unicode('%s %s' % (description, message), encoding))
+                failureText = xml_document.createCDATASection(xml_safe_unicode(error_info, encoding))
+                failure.appendChild(failureText)
+            # JUnit consumers tell failed tests by these elements, so the
+            # truncated failures get one as well
+            truncated = test_result.subtests.get_truncated()
+            if truncated:
+                elem_name = test_result.subtests.errored and 'error' or 'failure'
+                failure = xml_document.createElement(elem_name)
+                testcase.appendChild(failure)
+                failure.setAttribute('type', 'subTest')
+                failure.setAttribute('message', '%d subtest failure%s, details truncated' % (
+                    truncated, truncated != 1 and "s" or ""))
+
+        if test_result.outcome != _TestInfo.SUCCESS and test_result.err is not None:
             elem_name = ('failure', 'error', 'skipped')[test_result.outcome - 1]
             failure = xml_document.createElement(elem_name)
             testcase.appendChild(failure)
@@ -471,7 +700,10 @@ class XMLTestRunner(TextTestRunner):
     """
     def __init__(self, output='.', outsuffix=None, stream=sys.stderr,
                  descriptions=True, verbosity=1, elapsed_times=True,
-                 per_test_output=False, encoding='utf-8'):
+                 per_test_output=False, encoding='utf-8', cache_file=None,
+                 cache_max_entries=10000, subtest_failure_limit=100,
+                 test_timeout=None, suite_timeout=None,
+                 timeout_action='continue'):
         TextTestRunner.__init__(self, stream, descriptions, verbosity)
         self.verbosity = verbosity
         self.output = output
@@ -482,6 +714,21 @@ class XMLTestRunner(TextTestRunner):
         self.elapsed_times = elapsed_times
         self.per_test_output = per_test_output
         self.encoding = encoding
+        self.cache_file = cache_file
+        self.cache_max_entries = cache_max_entries
+        self.subtest_failure_limit = subtest_failure_limit
+        self.test_timeout = test_timeout
+        self.suite_timeout = suite_timeout
+        if timeout_action not in ('continue', 'exit'):
+            raise ValueError(
+                "timeout_action must be 'continue' or 'exit', not %r"
+                % (timeout_action,)
+            )
+        self.timeout_action = timeout_action
+        self._watchdog = None
+        self._timeout = None
+        self._previous_alarm_handler = None
+        self._main_thread = None
 
     def _make_result(self):
         """
@@ -489,7 +736,9 @@ class XMLTestRunner(TextTestRunner):
         information about the executed tests.
         """
         return _XMLTestResult(
-            self.stream, self.descriptions, self.verbosity, self.elapsed_times, self.per_test_output, self.encoding
+            self.stream, self.descriptions, self.verbosity, self.elapsed_times, self.per_test_output, self.encoding,
+            track_modules=bool(self.cache_file),
+            subtest_failure_limit=self.subtest_failure_limit
         )
 
     def _patch_standard_output(self):
@@ -507,6 +756,107 @@ class XMLTestRunner(TextTestRunner):
         sys.stdout = sys.stdout.delegate
         sys.stderr = sys.stderr.delegate
 
+    def _start_watchdog(self, result):
+        """
+        Starts watching for tests that exceed test_timeout, or for a test
+        run that exceeds suite_timeout.
+
+        Tests that time out are interrupted with a TestTimeout exception if
+        timeout_action is 'continue' and the platform allows it; otherwise
+        the reports collected so far are generated and the process exits.
+
+        test_timeout only covers tests from startTest to stopTest, which
+        leaves out class and module fixtures such as setUpClass and
+        setUpModule; only suite_timeout applies to them.
+
+        The SIGALRM handler is replaced for the duration of the run and
+        passes on the signals it did not cause to the previous handler, but
+        tests that install their own SIGALRM handler cannot be interrupted.
+        """
+        interrupt = None
+        if self.timeout_action == 'continue' and \
+                hasattr(signal, 'pthread_kill'):
+            try:
+                self._previous_alarm_handler = signal.signal(
+                    signal.SIGALRM, self._raise_timeout
+                )
+            except ValueError:
+                # Not running in the main thread
+                pass
+            else:
+                self._main_thread = threading.current_thread().ident
+                interrupt = self._interrupt_test
+
+        self._watchdog = Watchdog(
+            partial(self._expire, result), interrupt,
+            self.test_timeout, self.suite_timeout
+        )
+        result.watchdog = self._watchdog
+        self._watchdog.start()
+
+    def _stop_watchdog(self):
+        """
+        Stops watching the test run.
+        """
+        self._watchdog.stop()
+        self._watchdog = self._timeout = None
+        if self._previous_alarm_handler is not None:
+            signal.signal(signal.SIGALRM, self._previous_alarm_handler)
+            self._previous_alarm_handler = None
+
+    def _interrupt_test(self, test, timeout):
+        """
+        Called by the watchdog thread to interrupt a test that timed out.
+        """
+        self._timeout = (test, timeout)
+        signal.pthread_kill(self._main_thread, signal.SIGALRM)
+
+    def _raise_timeout(self, signum, frame):
+        """
+        Raises the pending TestTimeout in the main thread, unless the test
+        finished in the meantime or the signal arrived outside of the test
+        code, e.g. while its result was being reported. The watchdog then
+        expires if the test does not finish on its own.
+
+        SIGALRM signals not sent by the watchdog, e.g. from signal.alarm,
+        are passed on to the handler installed before the test run.
+        """
+        if self._timeout is None:
+            previous = self._previous_alarm_handler
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                # Terminate the process, as it would without the watchdog
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+            return
+
+        test, timeout = self._timeout
+        self._timeout = None
+        if test is self._watchdog.test and in_test_code(frame):
+            raise timeout
+
+    def _expire(self, result, test, timeout):
+        """
+        Called by the watchdog thread when the tests cannot go on. Reports
+        the running test as an error, generates the reports collected so
+        far and exits.
+        """
+        if test is not None:
+            result.addError(test, (TestTimeout, timeout, None))
+            result.stopTest(test)
+        self.stream.writeln()
+        self.stream.writeln('%s, aborting.' % timeout)
+        if test is None:
+            # Not within a test (e.g. in setUpClass), so there is no test
+            # case to record the stacks in
+            self.stream.writeln(timeout.stacks)
+        self.stream.writeln('Generating XML reports...')
+        result.generate_reports(self)
+        self.stream.flush()
+        sys.stdout.flush()
+        os._exit(1)
+
     def run(self, test):
         """
         Runs the given test case or test suite.
@@ -515,6 +865,15 @@ class XMLTestRunner(TextTestRunner):
             # Prepare the test execution
             self._patch_standard_output()
             result = self._make_result()
+            if self.test_timeout is not None or \
+                    self.suite_timeout is not None:
+                self._start_watchdog(result)
+
+            # Skip the tests whose results are still valid
+            cache = None
+            if self.cache_file:
+                cache = ResultCache(self.cache_file, self.cache_max_entries)
+                test = cache.select(test, result)
 
             # Print a nice header
             self.stream.writeln()
@@ -527,6 +886,15 @@ class XMLTestRunner(TextTestRunner):
             stop_time = time.time()
             time_taken = stop_time - start_time
 
+            if self._watchdog is not None:
+                self._stop_watchdog()
+
+            # Update the results cache
+            if cache is not None:
+                result.track_testcase_modules()
+                cache.update(result)
+                cache.save()
+
             # Print results
             result.printErrors()
             self.stream.writeln(result.separator2)
@@ -534,6 +902,12 @@ class XMLTestRunner(TextTestRunner):
             self.stream.writeln("Ran %d test%s in %.3fs" % (
                 run, run != 1 and "s" or "", time_taken)
             )
+            cached = len([t for t in result.successes if t.cached] +
+                         [t for t, _ in result.skipped if t.cached])
+            if cached:
+                self.stream.writeln("Reused %d cached result%s" % (
+                    cached, cached != 1 and "s" or "")
+                )
             self.stream.writeln()
 
             expectedFails = unexpectedSuccesses = skipped = 0
@@ -575,6 +949,8 @@ class XMLTestRunner(TextTestRunner):
             self.stream.writeln('Generating XML reports...')
             result.generate_reports(self)
         finally:
+            if self._watchdog is not None:
+                self._stop_watchdog()
             self._restore_standard_output()
 
         return result
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module provides the ResultCache class, which allows XMLTestRunner to
+skip TestCase classes whose source code (and the source code of the project
+modules they depend on) did not change since the previous run, reusing the
+results recorded back then.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import types
+import unittest
+
+try:
+    # JSON strings are decoded to unicode in Python 2
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
+
+
+def testcase_key(test):
+    """
+    Returns the fully qualified name of the TestCase class of a test.
+    """
+    testcase = type(test)
+    return '%s.%s' % (testcase.__module__,
+                      getattr(testcase, '__qualname__', testcase.__name__))
+
+
+# Description of the errors raised by class and module fixtures, e.g.
+# 'setUpClass (module.TestCase)' or 'tearDownModule (module)'
+FIXTURE_ERROR_RE = re.compile(
+    r'^(setUpClass|tearDownClass|setUpModule|tearDownModule) \((.+)\)$')
+
+# Outcomes of the tests stored in the cache (_TestInfo.SUCCESS and SKIP)
+CACHED_OUTCOMES = (0, 3)
+
+
+def _valid_entry(entry):
+    """
+    Tells whether an entry read from the cache file has the expected
+    structure.
+    """
+    try:
+        if not isinstance(entry['modules'], dict) or \
+                not isinstance(entry['tests'], dict):
+            return False
+        float(entry['last_used'])
+        for filename in entry['modules'].values():
+            if not isinstance(filename, string_types):
+                return False
+        for test in entry['tests'].values():
+            if test['outcome'] not in CACHED_OUTCOMES:
+                return False
+            float(test['time'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return True
+
+
+def _project_file(name, project_root):
+    """
+    Returns the source file of the given module if it belongs to the
+    project, i.e. if it lives under project_root and outside of any
+    installed packages directory, or None otherwise.
+    """
+    module = sys.modules.get(name)
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return None
+    filename = os.path.abspath(filename)
+    if filename.endswith(('.pyc', '.pyo')):
+        filename = filename[:-1]
+    if not filename.startswith(project_root + os.sep):
+        return None
+    if 'site-packages' in filename or 'dist-packages' in filename:
+        return None
+    return filename
+
+
+def _with_parents(name):
+    """
+    Returns the given module name along with the names of its parent
+    packages, which get imported with it.
+    """
+    parts = name.split('.')
+    return ['.'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+class ResultCache(object):
+    """
+    Keeps the results of the TestCase classes executed in previous runs in
+    a local JSON file, together with the hash of the source files each class
+    depends on.
+
+    The file holds at most max_entries classes; the least recently used ones
+    are evicted first.
+    """
+
+    def __init__(self, filename, max_entries=10000, project_root=None):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.project_root = os.path.abspath(project_root or os.getcwd())
+        self.entries = {}
+        self._file_hashes = {}
+        self._imports = {}
+        self.load()
+
+    def load(self):
+        """
+        Loads the cache file, starting with an empty cache if it does not
+        exist or could not be parsed. Malformed entries are discarded.
+        """
+        try:
+            with open(self.filename, 'r') as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            entries = {}
+        if not isinstance(entries, dict):
+            entries = {}
+        self.entries = dict((key, entry) for key, entry in entries.items()
+                            if _valid_entry(entry))
+
+    def save(self):
+        """
+        Writes the cache file, evicting the least recently used entries
+        if it holds more than max_entries classes.
+        """
+        if len(self.entries) > self.max_entries:
+            keys = sorted(self.entries,
+                          key=lambda k: self.entries[k].get('last_used', 0))
+            for key in keys[:len(self.entries) - self.max_entries]:
+                del self.entries[key]
+
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(self.filename, 'w') as cache_file:
+            json.dump(self.entries, cache_file, sort_keys=True)
+
+    def _file_hash(self, filename):
+        """
+        Returns the hash of the contents of the given file, or None if it
+        could not be read.
+        """
+        if filename not in self._file_hashes:
+            try:
+                with open(filename, 'rb') as source_file:
+                    digest = hashlib.sha1(source_file.read()).hexdigest()
+            except (IOError, OSError):
+                digest = None
+            self._file_hashes[filename] = digest
+        return self._file_hashes[filename]
+
+    def _modules_hash(self, modules):
+        """
+        Returns a hash of the source files of the given modules, which is
+        a dict mapping module names to source files.
+        """
+        digest = hashlib.sha1()
+        for name in sorted(modules):
+            file_hash = self._file_hash(modules[name])
+            if file_hash is None:
+                return None
+            digest.update(('%s:%s\n' % (name, file_hash)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _module_imports(self, name, filename):
+        """
+        Returns the names of the modules a project module may use: the ones
+        its source imports, including through 'from x import y', and the
+        ones its globals come from.
+        """
+        if name in self._imports:
+            return self._imports[name]
+
+        module = sys.modules[name]
+        names = set()
+        for value in list(vars(module).values()):
+            if isinstance(value, types.ModuleType):
+                names.add(value.__name__)
+            elif isinstance(value, (type, types.FunctionType)):
+                names.add(value.__module__)
+
+        if hasattr(module, '__path__'):
+            package = name
+        else:
+            package = name.rpartition('.')[0]
+        try:
+            with open(filename, 'rb') as source_file:
+                tree = ast.parse(source_file.read(), filename)
+        except (IOError, OSError, SyntaxError, ValueError):
+            tree = None
+        for node in ast.walk(tree) if tree is not None else ():
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    names.update(_with_parents(alias.name))
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    base = package.split('.')
+                    base = '.'.join(base[:len(base) - node.level + 1])
+                    if node.module:
+                        base = '%s.%s' % (base, node.module) if base else node.module
+                else:
+                    base = node.module
+                if not base:
+                    continue
+                names.update(_with_parents(base))
+                names.update('%s.%s' % (base, alias.name)
+                             for alias in node.names)
+
+        self._imports[name] = names
+        return names
+
+    def _dependencies(self, testcase, imported_modules):
+        """
+        Returns the project modules a TestCase class depends on: its own
+        module and the ones imported while the class was running, along
+        with every project module these import, transitively.
+        """
+        modules = {}
+        pending = set(imported_modules)
+        pending.add(testcase.__module__)
+        while pending:
+            name = pending.pop()
+            if name in modules:
+                continue
+            filename = _project_file(name, self.project_root)
+            if filename is None:
+                continue
+            modules[name] = filename
+            pending.update(self._module_imports(name, filename))
+        return modules
+
+    def _lookup(self, test):
+        """
+        Returns the cached result of a test, or None if it must be run.
+        """
+        key = testcase_key(test)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if key not in self._valid:
+            self._valid[key] = (
+                entry.get('hash') is not None and
+                self._modules_hash(entry.get('modules', {})) == entry['hash']
+            )
+        if not self._valid[key]:
+            return None
+        return entry['tests'].get(test.id())
+
+    def select(self, test, result):
+        """
+        Returns a copy of the given test suite without the tests whose
+        results could be reused. These results are added to the given
+        _XMLTestResult, marked as cached.
+        """
+        self._valid = {}
+        self._reused = set()
+        return self._filter(test, result)
+
+    def _filter(self, test, result):
+        if isinstance(test, unittest.TestSuite):
+            tests = list(test)
+            children = [self._filter(child, result) for child in tests]
+            if all(a is b for a, b in zip(tests, children)):
+                return test
+            suite = type(test)()
+            for child in children:
+                if child is not None:
+                    suite.addTest(child)
+            return suite
+
+        if not isinstance(test, unittest.TestCase):
+            return test
+        cached = self._lookup(test)
+        if cached is None:
+            return test
+        result.addCached(test, cached['outcome'], cached.get('reason'),
+                         cached['time'])
+        self._reused.add(testcase_key(test))
+        return None
+
+    def update(self, result):
+        """
+        Records the results of the TestCase classes that were executed.
+        Classes with failing tests or fixtures are removed from the cache
+        so they are run again next time.
+        """
+        now = time.time()
+        for key in self._reused:
+            self.entries[key]['last_used'] = now
+
+        # Errors raised by setUpClass, tearDownModule and the like are
+        # reported on unittest's _ErrorHolder instead of a TestCase
+        failed_testcases, failed_modules = set(), set()
+        for test_info, _ in result.errors + result.failures:
+            if isinstance(test_info.test_method, unittest.TestCase):
+                continue
+            match = FIXTURE_ERROR_RE.match(
+                getattr(test_info.test_method, 'description', ''))
+            if match is None:
+                continue
+            if match.group(1).endswith('Class'):
+                failed_testcases.add(match.group(2))
+            else:
+                failed_modules.add(match.group(2))
+
+        def fixture_failed(key):
+            return key in failed_testcases or any(
+                key.startswith(module + '.') for module in failed_modules)
+
+        for key in [k for k in self.entries if fixture_failed(k)]:
+            del self.entries[key]
+
+        testcases = {}
+        for tests in (result.successes, result.failures, result.errors,
+                      result.skipped):
+            for test_info in tests:
+                if isinstance(test_info, tuple):
+                    test_info = test_info[0]
+                if test_info.cached or not isinstance(
+                        test_info.test_method, unittest.TestCase):
+                    continue
+                key = testcase_key(test_info.test_method)
+                testcases.setdefault(key, []).append(test_info)
+
+        for key, test_infos in testcases.items():
+            outcomes = set(t.outcome for t in test_infos)
+            if outcomes - set(CACHED_OUTCOMES) or fixture_failed(key):
+                self.entries.pop(key, None)
+                continue
+            testcase = type(test_infos[0].test_method)
+            modules = self._dependencies(
+                testcase, result.testcase_modules.get(key, ()))
+            # Tests reused in this run still belong to the class
+            tests = {}
+            if key in self._reused:
+                tests.update(self.entries[key]['tests'])
+            for test_info in test_infos:
+                tests[test_info.test_id] = {
+                    'outcome': test_info.outcome,
+                    'reason': test_info.err if test_info.outcome == test_info.SKIP else None,
+                    'time': test_info.elapsed_time,
+                }
+            self.entries[key] = {
+                'hash': self._modules_hash(modules),
+                'modules': modules,
+                'tests': tests,
+                'last_used': now,
+            }
@@ -4,13 +4,350 @@
 """Executable module to test unittest-xml-reporting.
 """
 
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import xmlrunner
+from io import BytesIO, StringIO
+
 
 class XMLTestRunnerTestCase(unittest.TestCase):
     """XMLTestRunner test case.
     """
-    pass
+    class DummyTest(unittest.TestCase):
+        def test_pass(self):
+            pass
+
+        @unittest.skip('demonstrating skipping')
+        def test_skip(self):
+            pass
+
+    class DummyOtherTest(unittest.TestCase):
+        def test_pass(self):
+            pass
+
+    class DummyFixtureErrorTest(unittest.TestCase):
+        @classmethod
+        def tearDownClass(cls):
+            raise RuntimeError('expected error')
+
+        def test_pass(self):
+            pass
+
+    class DummyFailingTest(unittest.TestCase):
+        def test_fail(self):
+            self.fail('expected failure')
+
+    class DummySubTest(unittest.TestCase):
+        def test_subtests(self):
+            for i in range(10):
+                with self.subTest(i=i):
+                    self.assertTrue(i % 3, 'multiple of three')
+
+        def test_skipped_subtests(self):
+            for i in range(4):
+                with self.subTest(i=i):
+                    if i == 0:
+                        self.skipTest('demonstrating skipping')
+                    self.assertLess(i, 2)
+
+        def test_erroring_subtests(self):
+            for i in range(3):
+                with self.subTest(i=i):
+                    self.assertTrue(i < 2 or 1 / 0)
+
+    class DummySlowTest(unittest.TestCase):
+        def test_slow(self):
+            time.sleep(10)
+
+        def test_pass(self):
+            pass
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmpdir, 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, *testcases, **kwargs):
+        suite = unittest.TestSuite()
+        for testcase in testcases:
+            if isinstance(testcase, unittest.TestCase):
+                suite.addTest(testcase)
+            else:
+                suite.addTest(
+                    unittest.TestLoader().loadTestsFromTestCase(testcase))
+        output = BytesIO()
+        runner = xmlrunner.XMLTestRunner(output=output, stream=StringIO(),
+                                         **kwargs)
+        result = runner.run(suite)
+        return result, output.getvalue().decode('utf-8')
+
+    def test_cache_reuses_passing_testcases(self):
+        result, output = self._run(self.DummyTest, cache_file=self.cache_file)
+        self.assertNotIn('cached="true"', output)
+        self.assertEqual(result.testsRun, 2)
+
+        result, output = self._run(self.DummyTest, cache_file=self.cache_file)
+        self.assertEqual(output.count('cached="true"'), 2)
+        self.assertEqual(result.testsRun, 2)
+        self.assertEqual(len(result.skipped), 1)
+
+    def test_cache_reruns_failing_testcases(self):
+        self._run(self.DummyFailingTest, cache_file=self.cache_file)
+        result, output = self._run(self.DummyFailingTest,
+                                   cache_file=self.cache_file)
+        self.assertNotIn('cached="true"', output)
+        self.assertEqual(len(result.errors), 1)
+
+    def test_cache_reruns_testcases_with_failing_fixtures(self):
+        result, output = self._run(self.DummyFixtureErrorTest,
+                                   cache_file=self.cache_file)
+        self.assertEqual(len(result.errors), 1)
+        result, output = self._run(self.DummyFixtureErrorTest,
+                                   cache_file=self.cache_file)
+        self.assertNotIn('cached="true"', output)
+        self.assertEqual(len(result.errors), 1)
+
+    def test_cache_keys_nested_testcases_by_qualified_name(self):
+        class First(object):
+            class Nested(unittest.TestCase):
+                def test_pass(self):
+                    pass
+
+        class Second(object):
+            class Nested(unittest.TestCase):
+                def test_pass(self):
+                    pass
+
+        self.assertNotEqual(xmlrunner.testcase_key(First.Nested('test_pass')),
+                            xmlrunner.testcase_key(Second.Nested('test_pass')))
+
+    def test_cache_discards_malformed_entries(self):
+        self._run(self.DummyTest, cache_file=self.cache_file)
+        with open(self.cache_file) as cache_file:
+            entries = json.load(cache_file)
+        for entry in entries.values():
+            for test in entry['tests'].values():
+                del test['outcome']
+        with open(self.cache_file, 'w') as cache_file:
+            json.dump(entries, cache_file)
+
+        self.assertEqual(xmlrunner.ResultCache(self.cache_file).entries, {})
+        result, output = self._run(self.DummyTest, cache_file=self.cache_file)
+        self.assertNotIn('cached="true"', output)
+        self.assertEqual(result.testsRun, 2)
+
+    def test_cache_evicts_least_recently_used(self):
+        self._run(self.DummyOtherTest, self.DummyTest,
+                  cache_file=self.cache_file)
+        self._run(self.DummyTest, cache_file=self.cache_file,
+                  cache_max_entries=1)
+        cache = xmlrunner.ResultCache(self.cache_file)
+        self.assertEqual(list(cache.entries), [
+            xmlrunner.testcase_key(self.DummyTest('test_pass'))
+        ])
+
+    def test_cache_keeps_suite_types(self):
+        class CustomSuite(unittest.TestSuite):
+            pass
+
+        suite = CustomSuite([self.DummyTest('test_pass'),
+                             self.DummyOtherTest('test_pass')])
+        xmlrunner.XMLTestRunner(output=BytesIO(), stream=StringIO(),
+                                cache_file=self.cache_file).run(suite)
+        cache = xmlrunner.ResultCache(self.cache_file)
+        result = xmlrunner._XMLTestResult(StringIO())
+        suite = CustomSuite([self.DummyFailingTest('test_fail')])
+        self.assertIs(cache.select(suite, result), suite)
+        suite = CustomSuite([self.DummyTest('test_pass'),
+                             self.DummyFailingTest('test_fail')])
+        selected = cache.select(suite, result)
+        self.assertIsInstance(selected, CustomSuite)
+        self.assertEqual(selected.countTestCases(), 1)
+
+    def test_cache_follows_indirect_dependencies(self):
+        project = os.path.join(self.tmpdir, 'project')
+        os.makedirs(os.path.join(project, 'proj'))
+        sources = {
+            'proj/__init__.py': '',
+            'proj/api.py': 'from proj.db import VALUE\n',
+            'proj/db.py': 'VALUE = 1\n',
+            'test_api.py': '\n'.join([
+                'import unittest, xmlrunner',
+                'from proj import api',
+                'class ApiTest(unittest.TestCase):',
+                '    def test_value(self):',
+                '        self.assertEqual(api.VALUE, 1)',
+                'unittest.main(testRunner=xmlrunner.XMLTestRunner(',
+                '    output=%r, cache_file="cache.json"))' % self.tmpdir,
+            ]),
+        }
+        for name, source in sources.items():
+            with open(os.path.join(project, name), 'w') as source_file:
+                source_file.write(source)
+
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([
+            os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+            project
+        ]))
+
+        def run():
+            process = subprocess.Popen(
+                [sys.executable, '-B', 'test_api.py'], cwd=project, env=env,
+                stderr=subprocess.PIPE)
+            stderr = process.communicate()[1].decode('utf-8')
+            return process.returncode, 'Reused 1 cached result' in stderr
+
+        self.assertEqual(run(), (0, False))
+        self.assertEqual(run(), (0, True))
+        with open(os.path.join(project, 'proj', 'db.py'), 'w') as db:
+            db.write('VALUE = 2\n')
+        self.assertEqual(run(), (1, False))
+
+    def test_subtest_failures_are_reported(self):
+        result, output = self._run(self.DummySubTest('test_subtests'))
+        self.assertEqual(len(result.failures), 1)
+        self.assertIn('subtests="10"', output)
+        self.assertIn('subtest-failures="4"', output)
+        self.assertEqual(output.count('<failure '), 4)
+        self.assertIn('message="(i=3) 0 is not true : multiple of three"',
+                      output)
+
+    def test_subtest_failures_are_truncated(self):
+        result, output = self._run(self.DummySubTest('test_subtests'),
+                                   subtest_failure_limit=1)
+        self.assertIn('subtest-failures="4"', output)
+        self.assertIn('subtest-failures-truncated="3"', output)
+        self.assertEqual(output.count('<failure '), 2)
+        self.assertIn('message="3 subtest failures, details truncated"',
+                      output)
+        self.assertIn('... and 3 more subtest failures',
+                      result.failures[0][1])
+
+    def test_skipped_subtests_do_not_hide_failures(self):
+        result, output = self._run(self.DummySubTest('test_skipped_subtests'))
+        self.assertFalse(result.wasSuccessful())
+        self.assertEqual(len(result.failures), 1)
+        self.assertEqual(len(result.skipped), 0)
+        self.assertIn('subtests="4"', output)
+        self.assertIn('subtest-failures="2"', output)
+        self.assertIn('subtest-skips="1"', output)
+        self.assertNotIn('_SubTest', output)
+
+    def test_subtest_errors_beyond_limit(self):
+        result, output = self._run(self.DummySubTest('test_erroring_subtests'),
+                                   subtest_failure_limit=0)
+        self.assertEqual(len(result.errors), 1)
+        self.assertEqual(len(result.failures), 0)
+        self.assertIn('errors="1"', output)
+        self.assertEqual(output.count('<error '), 1)
+        self.assertIn('message="1 subtest failure, details truncated"',
+                      output)
+
+    def test_test_timeout_interrupts_test(self):
+        result, output = self._run(self.DummySlowTest, test_timeout=0.5)
+        self.assertEqual(result.testsRun, 2)
+        self.assertEqual(len(result.errors), 1)
+        self.assertEqual(len(result.successes), 1)
+        self.assertIn('type="TestTimeout"', output)
+        self.assertIn('message="Test took longer than 0.500s"', output)
+        self.assertIn('in test_slow', output)
+
+    def test_test_timeout_only_interrupts_test_code(self):
+        self.assertTrue(xmlrunner.in_test_code(sys._getframe()))
+        namespace = {'sys': sys}
+        exec(compile('frame = sys._getframe()', xmlrunner.__file__, 'exec'),
+             namespace)
+        self.assertFalse(xmlrunner.in_test_code(namespace['frame']))
+        # Library code called from XMLTestRunner, e.g. in stopTest
+        exec(compile('def get_frame():\n    return sys._getframe()\n',
+                     threading.__file__, 'exec'), namespace)
+        exec(compile('frame = get_frame()', xmlrunner.__file__, 'exec'),
+             namespace)
+        self.assertFalse(xmlrunner.in_test_code(namespace['frame']))
+
+    @unittest.skipUnless(hasattr(signal, 'setitimer'), 'requires setitimer')
+    def test_test_timeout_passes_on_other_alarms(self):
+        alarms = []
+
+        class AlarmTest(unittest.TestCase):
+            def test_alarm(self):
+                signal.setitimer(signal.ITIMER_REAL, 0.05)
+                time.sleep(0.5)
+
+        previous = signal.signal(signal.SIGALRM,
+                                 lambda signum, frame: alarms.append(signum))
+        try:
+            result, output = self._run(AlarmTest, test_timeout=5)
+        finally:
+            signal.signal(signal.SIGALRM, previous)
+        self.assertEqual(alarms, [signal.SIGALRM])
+        self.assertTrue(result.wasSuccessful())
+
+    def test_suite_timeout_exits_with_reports(self):
+        script = '\n'.join([
+            'import time, unittest, xmlrunner',
+            'class PassingTest(unittest.TestCase):',
+            '    def test_pass(self):',
+            '        pass',
+            'class ZHangingTest(unittest.TestCase):',
+            '    @classmethod',
+            '    def setUpClass(cls):',
+            '        time.sleep(10)',
+            '    def test_pass(self):',
+            '        pass',
+            'unittest.main(testRunner=xmlrunner.XMLTestRunner(',
+            '    output=%r, suite_timeout=1))' % self.tmpdir,
+        ])
+        process = subprocess.Popen(
+            [sys.executable, '-c', script], stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        stderr = process.communicate()[1].decode('utf-8')
+        self.assertEqual(process.returncode, 1)
+        self.assertIn('Test run took longer than 1.000s, aborting.', stderr)
+        self.assertIn('in setUpClass', stderr)
+        reports = [f for f in os.listdir(self.tmpdir) if f.endswith('.xml')]
+        self.assertEqual(len(reports), 1)
+        self.assertIn('PassingTest', reports[0])
+
+    def test_invalid_timeout_action(self):
+        self.assertRaises(ValueError, xmlrunner.XMLTestRunner,
+                          test_timeout=1, timeout_action='exti')
+
+    def test_test_timeout_exits_with_reports(self):
+        script = '\n'.join([
+            'import time, unittest, xmlrunner',
+            'class SlowTest(unittest.TestCase):',
+            '    def test_pass(self):',
+            '        pass',
+            '    def test_slow(self):',
+            '        time.sleep(10)',
+            'unittest.main(testRunner=xmlrunner.XMLTestRunner(',
+            '    output=%r, test_timeout=0.5, timeout_action="exit"))'
+            % self.tmpdir,
+        ])
+        process = subprocess.Popen(
+            [sys.executable, '-c', script], stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        process.communicate()
+        self.assertEqual(process.returncode, 1)
+        reports = [f for f in os.listdir(self.tmpdir) if f.endswith('.xml')]
+        self.assertEqual(len(reports), 1)
+        with open(os.path.join(self.tmpdir, reports[0])) as report:
+            output = report.read()
+        self.assertIn('tests="2"', output)
+        self.assertIn('type="TestTimeout"', output)
+        self.assertIn('in test_slow', output)
+
 
 if __name__ == '__main__':
     unittest.main()
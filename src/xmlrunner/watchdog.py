@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module provides the Watchdog class, which allows XMLTestRunner to
+detect tests that run for too long and to record the stack of every thread
+in the reports when that happens.
+"""
+
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import unittest
+
+try:
+    # Added in Python 3.3
+    import faulthandler
+except ImportError:
+    faulthandler = None
+
+
+# Code that runs tests, as opposed to the tests themselves
+_UNITTEST_DIRS = (
+    os.path.dirname(os.path.abspath(unittest.__file__)) + os.sep,
+    os.path.splitext(os.path.abspath(contextlib.__file__))[0],
+)
+_XMLRUNNER_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_TESTCASE_MODULE = os.path.join(_UNITTEST_DIRS[0], 'case')
+
+
+def in_test_code(frame):
+    """
+    Tells whether the given frame runs code from a test (its body, setUp,
+    tearDown, cleanups or anything they call) rather than code from
+    unittest or from XMLTestRunner itself, where raising an exception
+    would abort the whole test run.
+
+    That is the case if, before reaching any XMLTestRunner frame, a frame
+    outside of unittest is found that was called by unittest.TestCase.
+    """
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if os.path.dirname(filename) + os.sep == _XMLRUNNER_DIR:
+            return False
+        caller = frame.f_back
+        if not filename.startswith(_UNITTEST_DIRS) and caller is not None:
+            caller_filename = os.path.abspath(caller.f_code.co_filename)
+            if os.path.splitext(caller_filename)[0] == _TESTCASE_MODULE:
+                return True
+        frame = caller
+    return False
+
+
+class TestTimeout(Exception):
+    """
+    Raised inside a test that took longer than the allowed time.
+
+    The stacks attribute holds the stack of every thread at the time the
+    timeout expired.
+    """
+
+    def __init__(self, message, stacks=''):
+        Exception.__init__(self, message)
+        self.stacks = stacks
+
+
+def dump_stacks():
+    """
+    Returns a text representation of the current stack of every thread.
+    """
+    if faulthandler is None:
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            stacks.append('Thread 0x%x:\n' % thread_id)
+            stacks.extend(traceback.format_stack(frame))
+        return ''.join(stacks)
+
+    # faulthandler writes straight to a file descriptor
+    with tempfile.TemporaryFile() as dump_file:
+        faulthandler.dump_traceback(dump_file, all_threads=True)
+        dump_file.seek(0)
+        return dump_file.read().decode('utf-8', 'replace')
+
+
+class Watchdog(object):
+    """
+    Watches the tests run by XMLTestRunner from a separate thread.
+
+    When a test runs for longer than test_timeout seconds, interrupt is
+    called with the test and a TestTimeout holding the stacks of all
+    threads. If interrupt is None, or if the test is still running
+    test_timeout seconds after being interrupted, or if the whole run
+    takes longer than suite_timeout seconds, expire is called instead,
+    which is not expected to return.
+    """
+
+    def __init__(self, expire, interrupt=None, test_timeout=None,
+                 suite_timeout=None):
+        self.expire = expire
+        self.interrupt = interrupt
+        self.test_timeout = test_timeout
+        self.suite_timeout = suite_timeout
+        self.test = None
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._suite_deadline = None
+        self._test_deadline = None
+        self._interrupted = False
+        self._thread = None
+
+    def start(self):
+        """
+        Starts watching the test run.
+        """
+        if self.suite_timeout is not None:
+            self._suite_deadline = time.time() + self.suite_timeout
+        self._thread = threading.Thread(target=self._run,
+                                        name='xmlrunner-watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops watching the test run.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def arm(self, test):
+        """
+        Called before a test starts.
+        """
+        with self._condition:
+            self.test = test
+            self._interrupted = False
+            if self.test_timeout is not None:
+                self._test_deadline = time.time() + self.test_timeout
+                self._condition.notify()
+
+    def disarm(self):
+        """
+        Called after a test finished.
+        """
+        with self._condition:
+            self.test = None
+            self._test_deadline = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                callback = self._wait()
+                if callback is None:
+                    return
+                test = self.test
+            callback(test)
+
+    def _wait(self):
+        """
+        Waits until a timeout expires and returns the function to call
+        about it, or None if the watchdog was stopped.
+        """
+        while not self._stopped:
+            now = time.time()
+            deadlines = [d for d in (self._suite_deadline, self._test_deadline)
+                         if d is not None]
+            if not deadlines:
+                self._condition.wait()
+            elif min(deadlines) > now:
+                self._condition.wait(min(deadlines) - now)
+            elif self._suite_deadline is not None and \
+                    self._suite_deadline <= now:
+                self._suite_deadline = self._test_deadline = None
+                return self._expire_suite
+            elif self.interrupt is None or self._interrupted:
+                self._suite_deadline = self._test_deadline = None
+                return self._expire_test
+            else:
+                # Give the test some time to tear down once interrupted
+                self._interrupted = True
+                self._test_deadline = now + self.test_timeout
+                return self._interrupt_test
+        return None
+
+    def _interrupt_test(self, test):
+        self.interrupt(test, TestTimeout(
+            'Test took longer than %.3fs' % self.test_timeout, dump_stacks()
+        ))
+
+    def _expire_test(self, test):
+        self.expire(test, TestTimeout(
+            'Test took longer than %.3fs' % self.test_timeout, dump_stacks()
+        ))
+
+    def _expire_suite(self, test):
+        self.expire(test, TestTimeout(
+            'Test run took longer than %.3fs' % self.suite_timeout,
+            dump_stacks()
+        ))